@@ -1,132 +1,275 @@
 # database.py
-import sqlite3
-from typing import List, Optional
+import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
+from typing import List, Optional, Tuple
 from models import Page, PageCreate # Import Page and PageCreate
+import sentiment
 import uuid
 import os
+import base64
+import json
 
 # Define the path for the SQLite database file
 DATABASE_FILE = "notebook.db" # Changed database file name
 
-def get_db_connection():
-    """Establishes and returns a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+# Shared connection pool, opened once at app startup (see main.py)
+POOL: Optional[SQLiteConnectionPool] = None
+
+# Size of each connection's prepared-statement cache
+CACHED_STATEMENTS = 256
+
+# Initial (title, content) pages inserted into an empty database
+SEED_PAGES = [
+    ("Welcome to your Notebook", "This is your first page! You can add new pages, edit existing ones, or delete them. Explore the tabs above!"),
+    ("My Daily Thoughts", "Today was a productive day. I managed to finish all my tasks before noon. Feeling good!"),
+    ("Grocery List", "Milk, Eggs, Bread, Butter, Coffee, Apples, Bananas"),
+]
+
+# SQL statements are module-level constants so every call reuses the same
+# string and hits the connection's prepared-statement cache
+_SQL_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS pages (
+        id BLOB PRIMARY KEY,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL
+    )
+"""
+# Lets the (title COLLATE NOCASE, id) listing order and its keyset cursor read
+# rows in index order instead of sorting; replaces the title-only index
+_SQL_DROP_OLD_TITLE_INDEX = "DROP INDEX IF EXISTS idx_pages_title_nocase"
+_SQL_CREATE_TITLE_INDEX = "CREATE INDEX IF NOT EXISTS idx_pages_title_nocase_id ON pages(title COLLATE NOCASE, id)"
+# One-row table holding a counter bumped by triggers on every change to
+# 'pages'; it backs the ETag of the page endpoints. The random epoch is set
+# when the row is created, so a recreated database never reuses old ETags.
+_SQL_CREATE_VERSION_TABLE = "CREATE TABLE IF NOT EXISTS pages_version (epoch TEXT, version INTEGER NOT NULL)"
+_SQL_VERSION_TABLE_INFO = "PRAGMA table_info(pages_version)"
+_SQL_ADD_VERSION_EPOCH = "ALTER TABLE pages_version ADD COLUMN epoch TEXT" # Tables created before the epoch existed
+_SQL_INIT_VERSION = "INSERT INTO pages_version (epoch, version) SELECT lower(hex(randomblob(8))), 0 WHERE NOT EXISTS (SELECT 1 FROM pages_version)"
+_SQL_INIT_VERSION_EPOCH = "UPDATE pages_version SET epoch = lower(hex(randomblob(8))) WHERE epoch IS NULL"
+_SQL_CREATE_VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS pages_bump_version_{event.lower()} AFTER {event} ON pages
+    BEGIN
+        UPDATE pages_version SET version = version + 1;
+    END
+    """
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+_SQL_SELECT_VERSION = "SELECT epoch, version FROM pages_version"
+_SQL_TABLE_INFO = "PRAGMA table_info(pages)"
+_SQL_SELECT_RAW = "SELECT id, title, content FROM pages"
+_SQL_COUNT = "SELECT COUNT(*) FROM pages"
+_SQL_INSERT = "INSERT INTO pages (id, title, content) VALUES (?, ?, ?)"
+# Pages are listed by title (id breaks ties) one keyset page at a time; the
+# plain >= on title lets SQLite seek into the index before the row-value check
+_SQL_SELECT_FIRST_PAGE = "SELECT id, title, content FROM pages ORDER BY title COLLATE NOCASE, id LIMIT :limit"
+_SQL_SELECT_NEXT_PAGE = """
+    SELECT id, title, content FROM pages
+    WHERE title COLLATE NOCASE >= :title AND (title COLLATE NOCASE, id) > (:title, :id)
+    ORDER BY title COLLATE NOCASE, id LIMIT :limit
+"""
+_SQL_SELECT_BY_ID = "SELECT id, title, content FROM pages WHERE id = ?"
+_SQL_UPDATE = "UPDATE pages SET title = ?, content = ? WHERE id = ?"
+_SQL_DELETE = "DELETE FROM pages WHERE id = ?"
+
+async def connection_factory() -> aiosqlite.Connection:
+    """Opens a new long-lived connection for the pool."""
+    # isolation_level=None: single statements autocommit; multi-statement
+    # writes open their own transaction with BEGIN IMMEDIATE
+    conn = await aiosqlite.connect(
+        DATABASE_FILE, cached_statements=CACHED_STATEMENTS, isolation_level=None
+    )
+    # Rows stay plain tuples (the default row factory); columns are read by position
+    # Per-connection tuning; paid once since pooled connections stay open
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    await conn.execute("PRAGMA temp_store=memory")
+    await conn.execute("PRAGMA cache_size=-64000") # ~64MB page cache
+    await conn.execute("PRAGMA mmap_size=268435456") # 256MB memory-mapped I/O
     return conn
 
-def create_table():
-    """Creates the 'pages' table if it doesn't already exist."""
-    conn = get_db_connection()
+def open_pool():
+    """Creates the shared connection pool. Called once from the startup hook."""
+    global POOL
+    POOL = SQLiteConnectionPool(connection_factory)
+
+async def close_pool():
+    """Closes every pooled connection. Called from the shutdown hook."""
+    global POOL
+    if POOL is not None:
+        await POOL.close()
+        POOL = None
+
+def _id_bytes(page_id: str) -> Optional[bytes]:
+    """Converts an API page ID (hex or dashed UUID) to its stored 16-byte form, or None if malformed."""
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pages (
-                id TEXT PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL
-            )
-        """)
-        conn.commit()
-    finally:
-        conn.close()
+        return uuid.UUID(page_id).bytes
+    except ValueError:
+        return None
+
+async def _migrate_text_ids(conn: aiosqlite.Connection):
+    """One-shot migration of a table created with TEXT UUID IDs to 16-byte BLOB IDs."""
+    # Check inside the write transaction so concurrently starting workers migrate only once
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = await conn.execute(_SQL_TABLE_INFO)
+        column_types = {row[1]: row[2] for row in await cursor.fetchall()} # (cid, name, type, ...)
+        if column_types.get('id', '').upper() != 'TEXT':
+            await conn.execute("COMMIT")
+            return
+        print("Migrating page IDs to BLOB...")
+        cursor = await conn.execute(_SQL_SELECT_RAW)
+        rows = [(uuid.UUID(page_id).bytes, title, content) for page_id, title, content in await cursor.fetchall()]
+        await conn.execute("DROP TABLE pages") # Also drops the old title index
+        await conn.execute(_SQL_CREATE_TABLE)
+        await conn.executemany(_SQL_INSERT, rows)
+        await conn.execute("COMMIT")
+    except Exception:
+        await conn.execute("ROLLBACK")
+        raise
+    print("Page IDs migrated.")
+
+async def _init_pages_version(conn: aiosqlite.Connection):
+    """Creates (or upgrades) the one-row pages_version table with a random epoch."""
+    # One write transaction so concurrently starting workers add the epoch only once
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        await conn.execute(_SQL_CREATE_VERSION_TABLE)
+        cursor = await conn.execute(_SQL_VERSION_TABLE_INFO)
+        if 'epoch' not in {row[1] for row in await cursor.fetchall()}:
+            await conn.execute(_SQL_ADD_VERSION_EPOCH)
+        await conn.execute(_SQL_INIT_VERSION)
+        await conn.execute(_SQL_INIT_VERSION_EPOCH)
+        await conn.execute("COMMIT")
+    except Exception:
+        await conn.execute("ROLLBACK")
+        raise
+
+async def create_table():
+    """Creates the 'pages' table, its title index and version counter if they don't already exist."""
+    async with POOL.connection() as conn:
+        await conn.execute(_SQL_CREATE_TABLE)
+        await _migrate_text_ids(conn)
+        await conn.execute(_SQL_DROP_OLD_TITLE_INDEX)
+        await conn.execute(_SQL_CREATE_TITLE_INDEX)
+        await _init_pages_version(conn)
+        for trigger in _SQL_CREATE_VERSION_TRIGGERS:
+            await conn.execute(trigger)
 
 # --- Database Operations ---
 
-def create_page_db_internal(page_title: str, page_content: str) -> Page:
+async def create_page_db_internal(page_title: str, page_content: str) -> Page:
     """
-    Internal function to create a page, used by both API and seeding.
-    Commits the transaction.
+    Internal function to create a page, used by the API.
+    The insert autocommits.
     """
-    conn = get_db_connection()
-    new_id = str(uuid.uuid4())
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO pages (id, title, content) VALUES (?, ?, ?)",
-            (new_id, page_title, page_content)
-        )
-        conn.commit()
-        return Page(id=new_id, title=page_title, content=page_content)
-    finally:
-        conn.close()
-
-def seed_database():
+    new_id = uuid.uuid4().bytes
+    async with POOL.connection() as conn:
+        await conn.execute(_SQL_INSERT, (new_id, page_title, page_content))
+    return Page(id=new_id, title=page_title, content=page_content)
+
+async def seed_database():
     """Seeds the database with initial data if it's empty."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM pages")
-        count = cursor.fetchone()[0]
+    async with POOL.connection() as conn:
+        # Count and insert in one write transaction (one commit), so workers
+        # starting at the same time can't both see an empty table
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = await conn.execute(_SQL_COUNT)
+            count = (await cursor.fetchone())[0]
+            if count == 0:
+                print("Seeding database with initial pages...")
+                rows = [(uuid.uuid4().bytes, title, content) for title, content in SEED_PAGES]
+                await conn.executemany(_SQL_INSERT, rows)
+            await conn.execute("COMMIT")
+        except Exception:
+            await conn.execute("ROLLBACK")
+            raise
         if count == 0:
-            print("Seeding database with initial pages...")
-            create_page_db_internal("Welcome to your Notebook", "This is your first page! You can add new pages, edit existing ones, or delete them. Explore the tabs above!")
-            create_page_db_internal("My Daily Thoughts", "Today was a productive day. I managed to finish all my tasks before noon. Feeling good!")
-            create_page_db_internal("Grocery List", "Milk, Eggs, Bread, Butter, Coffee, Apples, Bananas")
             print("Database seeded.")
-    finally:
-        conn.close()
 
 
-# Call create_table and seed_database when database.py is imported
-create_table()
-seed_database()
+async def get_pages_version() -> str:
+    """
+    Returns "<epoch>-<counter>", which changes whenever any page is created, updated
+    or deleted, and never repeats across a deleted and recreated database.
+    """
+    async with POOL.connection() as conn:
+        cursor = await conn.execute(_SQL_SELECT_VERSION)
+        epoch, version = await cursor.fetchone()
+        return f"{epoch}-{version}"
 
+def _encode_cursor(title: str, page_id: str) -> str:
+    """Builds the opaque pagination cursor pointing just past the given page."""
+    return base64.urlsafe_b64encode(json.dumps([title, page_id]).encode("utf-8")).decode("ascii")
 
-def get_all_pages() -> List[Page]:
-    """Retrieves all pages from the database."""
-    conn = get_db_connection()
-    pages = []
+def decode_cursor(cursor: str) -> dict:
+    """Turns a pagination cursor back into query parameters. Raises ValueError if malformed."""
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, content FROM pages ORDER BY title COLLATE NOCASE") # Order by title for consistency
-        for row in cursor.fetchall():
-            pages.append(Page(id=row['id'], title=row['title'], content=row['content']))
-    finally:
-        conn.close()
-    return pages
-
-def get_page_by_id(page_id: str) -> Optional[Page]:
+        title, page_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not (isinstance(title, str) and isinstance(page_id, str)):
+            raise ValueError("Cursor fields must be strings")
+        return {"title": title, "id": bytes.fromhex(page_id)}
+    except (json.JSONDecodeError, TypeError, ValueError, UnicodeError) as exc:
+        raise ValueError("Invalid page cursor") from exc
+
+async def get_all_pages(limit: int = 100, after: Optional[dict] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Retrieves up to `limit` pages after `after` (a cursor from decode_cursor), ordered
+    by title, as plain dicts ready for JSON encoding. Also returns the cursor of the
+    next page, or None at the end.
+    """
+    if after is None:
+        sql, params = _SQL_SELECT_FIRST_PAGE, {"limit": limit}
+    else:
+        sql, params = _SQL_SELECT_NEXT_PAGE, {**after, "limit": limit}
+    pages = []
+    async with POOL.connection() as conn:
+        async with conn.execute(sql, params) as rows:
+            async for row in rows: # Consume rows as they are stepped, without fetchall()
+                pages.append({"id": row[0].hex(), "title": row[1], "content": row[2]})
+    next_cursor = None
+    if len(pages) == limit: # A full page means there may be more rows
+        last = pages[-1]
+        next_cursor = _encode_cursor(last["title"], last["id"])
+    return pages, next_cursor
+
+async def get_page_by_id(page_id: str) -> Optional[Page]:
     """Retrieves a single page by its ID."""
-    conn = get_db_connection()
     page = None
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, content FROM pages WHERE id = ?", (page_id,))
-        row = cursor.fetchone()
+    key = _id_bytes(page_id)
+    if key is None:
+        return None # Malformed IDs can't match any page
+    async with POOL.connection() as conn:
+        cursor = await conn.execute(_SQL_SELECT_BY_ID, (key,))
+        row = await cursor.fetchone()
         if row:
-            page = Page(id=row['id'], title=row['title'], content=row['content'])
-    finally:
-        conn.close()
+            page = Page(id=row[0], title=row[1], content=row[2])
     return page
 
-def create_page_db(page_data: PageCreate) -> Page:
+async def create_page_db(page_data: PageCreate) -> Page:
     """Creates a new page from a PageCreate model."""
-    return create_page_db_internal(page_data.title, page_data.content)
+    return await create_page_db_internal(page_data.title, page_data.content)
 
 
-def update_page_db(page_id: str, new_title: str, new_content: str) -> Optional[Page]:
+async def update_page_db(page_id: str, new_title: str, new_content: str) -> Optional[Page]:
     """Updates the title and content of an existing page by ID."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE pages SET title = ?, content = ? WHERE id = ?",
-            (new_title, new_content, page_id)
-        )
-        conn.commit()
+    key = _id_bytes(page_id)
+    if key is None:
+        return None
+    async with POOL.connection() as conn:
+        cursor = await conn.execute(_SQL_UPDATE, (new_title, new_content, key))
+        sentiment.forget_page(key.hex()) # Cached sentiment no longer matches the content
         if cursor.rowcount > 0: # Check if any row was updated
-            return Page(id=page_id, title=new_title, content=new_content) # Return the updated page
+            return Page(id=key, title=new_title, content=new_content) # Return the updated page
         return None # Page not found
-    finally:
-        conn.close()
 
-def delete_page_db(page_id: str) -> bool:
+async def delete_page_db(page_id: str) -> bool:
     """Deletes a page from the database by ID. Returns True if deleted, False if not found."""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM pages WHERE id = ?", (page_id,))
-        conn.commit()
+    key = _id_bytes(page_id)
+    if key is None:
+        return False
+    async with POOL.connection() as conn:
+        cursor = await conn.execute(_SQL_DELETE, (key,))
+        sentiment.forget_page(key.hex())
         return cursor.rowcount > 0 # True if a row was deleted, False otherwise
-    finally:
-        conn.close()
\ No newline at end of file
@@ -1,13 +1,17 @@
 # main.py
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import router # Import the APIRouter instance from routes.py
+import database
+import sentiment
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Machine Learning Sentiment API",
     description="A CRUD API for managing pages and performing sentiment analysis.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse # Encode responses with orjson
 )
 
 origins = [
@@ -21,7 +25,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"], # Readable by the frontend for caching and pagination
 )
 
 # Include the API router
 app.include_router(router)
+
+# Open the shared SQLite connection pool and sentiment inference once per process
+@app.on_event("startup")
+async def startup():
+    database.open_pool()
+    await database.create_table()
+    await database.seed_database()
+    sentiment.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sentiment.stop()
+    await database.close_pool()
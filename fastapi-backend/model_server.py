@@ -0,0 +1,34 @@
+# model_server.py
+import asyncio
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from models import ClassifyIn
+import sentiment
+
+# Single-process model server shared by every API worker. Run it with one
+# worker so the model is loaded once and requests from all API workers are
+# batched together:
+#   uvicorn model_server:app --port 8080
+# then start the API with MODEL_SERVER_URL=http://localhost:8080
+app = FastAPI(
+    title="Sentiment Model Server",
+    description="Runs the sentiment model for all API workers.",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
+
+@app.on_event("startup")
+async def startup():
+    # Always infer locally here, even if MODEL_SERVER_URL is set in the environment
+    sentiment.start_local()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sentiment.stop_local()
+
+@app.post("/classify")
+async def classify(payload: ClassifyIn):
+    """Returns one {'label', 'score'} result per input text, in order."""
+    texts = [payload.inputs] if isinstance(payload.inputs, str) else payload.inputs
+    # Every text (and every chunk of a long one) joins the shared batching queue
+    return await asyncio.gather(*(sentiment.analyze_local(text) for text in texts))
@@ -1,6 +1,16 @@
 # models.py
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Annotated, List, Optional, Union
+
+# Longest text accepted by /analyze-sentiment/; longer payloads are rejected
+# during validation, before they reach the tokenizer and model
+MAX_SENTIMENT_TEXT_LENGTH = 4096
+# Most texts accepted in one /analyze-sentiment-batch/ request
+MAX_SENTIMENT_BATCH_SIZE = 256
+# Longest page content. Pages are split into model-sized chunks for sentiment
+# analysis, so this is far above MAX_SENTIMENT_TEXT_LENGTH, but it still bounds
+# the single texts the model server accepts
+MAX_PAGE_CONTENT_LENGTH = 1_000_000
 
 # Pydantic model for a Page in the notebook
 class PageBase(BaseModel):
@@ -9,11 +19,34 @@ class PageBase(BaseModel):
 
 # Model for creating a new page (inherits from PageBase)
 class PageCreate(PageBase):
-    pass
+    content: str = Field(max_length=MAX_PAGE_CONTENT_LENGTH)
 
 # Model for a Page as stored/retrieved, including its ID
 class Page(PageBase):
     id: str
 
+    @field_validator("id", mode="before")
+    @classmethod
+    def id_to_hex(cls, value):
+        # IDs are stored as 16-byte BLOBs; the API exposes them as 32-char hex strings
+        if isinstance(value, bytes):
+            return value.hex()
+        return value
+
     class Config:
         from_attributes = True # updated from orm_mode = True
+
+# Request body for free-form sentiment analysis
+class SentimentIn(BaseModel):
+    text: str = Field("", max_length=MAX_SENTIMENT_TEXT_LENGTH)
+
+# Request body for the model server's /classify: one text (free-form or a whole
+# page's content) or a batch of free-form texts from /analyze-sentiment-batch/
+class ClassifyIn(BaseModel):
+    inputs: Union[
+        Annotated[str, Field(max_length=MAX_PAGE_CONTENT_LENGTH)],
+        Annotated[
+            List[Annotated[str, Field(max_length=MAX_SENTIMENT_TEXT_LENGTH)]],
+            Field(min_length=1, max_length=MAX_SENTIMENT_BATCH_SIZE),
+        ],
+    ]
@@ -1,41 +1,82 @@
 # routes.py
-from fastapi import APIRouter, HTTPException
-from typing import List
-from models import Page, PageCreate
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import Field
+from typing import Annotated, List, Optional
+from models import MAX_SENTIMENT_BATCH_SIZE, Page, PageCreate, SentimentIn
 import database as db_operations # Alias database.py for clarity
-
-# Import pipeline from transformers for NLP tasks
-from transformers import pipeline
+import sentiment
 
 router = APIRouter()
-sentiment_analyzer = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
+
+
+# --- Conditional GET helpers ---
+
+async def pages_etag() -> str:
+    """ETag shared by the page read endpoints; changes whenever any page changes."""
+    return f'"{await db_operations.get_pages_version()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the client's If-None-Match header already holds this ETag."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates or "*" in candidates
 
 
 # --- API Endpoints for Pages ---
 
-@router.get("/pages/", response_model=List[Page])
-async def get_all_pages_api():
-    """Retrieve all pages from the database."""
-    return db_operations.get_all_pages()
+@router.get("/pages/")
+async def get_all_pages_api(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+):
+    """
+    Retrieve pages ordered by title, `limit` at a time. When more pages follow,
+    the X-Next-Cursor response header holds the `cursor` for the next request.
+    """
+    # Validate the cursor first so a malformed one is a 400 even with a matching ETag
+    after = None
+    if cursor is not None:
+        try:
+            after = db_operations.decode_cursor(cursor)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    etag = await pages_etag()
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag}) # Client copy is current
+    pages, next_cursor = await db_operations.get_all_pages(limit, after)
+    headers = {"ETag": etag}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    # Rows are already plain dicts; hand them straight to orjson with no model validation
+    return ORJSONResponse(pages, headers=headers)
 
 @router.get("/pages/{page_id}", response_model=Page)
-async def get_page_by_id_api(page_id: str):
+async def get_page_by_id_api(page_id: str, request: Request, response: Response):
     """Retrieve a single page by its ID."""
-    page = db_operations.get_page_by_id(page_id)
+    etag = await pages_etag()
+    page = await db_operations.get_page_by_id(page_id)
+    # Missing pages are a 404 even for a matching ETag or If-None-Match: *
     if page is None:
         raise HTTPException(status_code=404, detail="Page not found")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     return page
 
 @router.post("/pages/", response_model=Page, status_code=201)
 async def create_page_api(page: PageCreate):
     """Create a new page in the database."""
-    new_page = db_operations.create_page_db(page)
+    new_page = await db_operations.create_page_db(page)
     return new_page
 
 @router.put("/pages/{page_id}", response_model=Page)
 async def update_page_api(page_id: str, page: PageCreate):
     """Update an existing page's title and content by ID."""
-    updated_page = db_operations.update_page_db(page_id, page.title, page.content)
+    updated_page = await db_operations.update_page_db(page_id, page.title, page.content)
     if updated_page is None:
         raise HTTPException(status_code=404, detail="Page not found")
     return updated_page
@@ -43,7 +84,7 @@ async def update_page_api(page_id: str, page: PageCreate):
 @router.delete("/pages/{page_id}", status_code=204)
 async def delete_page_api(page_id: str):
     """Delete a page by its ID."""
-    if not db_operations.delete_page_db(page_id):
+    if not await db_operations.delete_page_db(page_id):
         raise HTTPException(status_code=404, detail="Page not found")
     return {"message": "Page deleted successfully"}
 
@@ -51,25 +92,48 @@ async def delete_page_api(page_id: str):
 # --- API Endpoint for general Sentiment Analysis using Hugging Face ---
 
 @router.post("/analyze-sentiment/")
-async def analyze_sentiment(data: dict):
+async def analyze_sentiment(payload: SentimentIn):
     """
     Performs sentiment analysis on the provided text using a pre-trained Hugging Face model.
+    Texts longer than MAX_SENTIMENT_TEXT_LENGTH characters are rejected with a 422.
     """
-    text = data.get("text", "")
+    text = payload.text
     if not text:
         raise HTTPException(status_code=400, detail="No text provided for sentiment analysis.")
 
-    # Perform sentiment analysis using the Hugging Face pipeline
-    # The pipeline returns a list of dictionaries, e.g., [{'label': 'POSITIVE', 'score': 0.999}]
-    result = sentiment_analyzer(text)
+    # Perform sentiment analysis through the shared batching queue (cached per text)
+    # Each result is a dictionary, e.g., {'label': 'POSITIVE', 'score': 0.999}
+    result = await sentiment.score(text)
 
     # Extract the sentiment label and score
-    sentiment_label = result[0]['label']
-    sentiment_score = result[0]['score']
+    sentiment_label = result['label']
+    sentiment_score = result['score']
 
     return {"text": text, "sentiment": sentiment_label, "score": sentiment_score}
 
 
+@router.post("/analyze-sentiment-batch/")
+async def analyze_sentiment_batch(
+    payload: Annotated[List[SentimentIn], Field(min_length=1, max_length=MAX_SENTIMENT_BATCH_SIZE)],
+):
+    """
+    Performs sentiment analysis on a list of texts in one request. All texts go
+    through the model together, sharing batched forward passes with any
+    concurrent single-text requests. Results are returned in input order.
+    Empty lists and lists over MAX_SENTIMENT_BATCH_SIZE items are rejected with a 422.
+    """
+    texts = [item.text for item in payload]
+    if not all(texts):
+        raise HTTPException(status_code=400, detail="Every item must provide text for sentiment analysis.")
+
+    results = await sentiment.score_many(texts)
+
+    return [
+        {"text": text, "sentiment": result['label'], "score": result['score']}
+        for text, result in zip(texts, results)
+    ]
+
+
 # --- ML Endpoint: Sentiment Analysis using Page Getters (Updated for Hugging Face) ---
 
 @router.post("/analyze-page-sentiment/{page_id}")
@@ -79,7 +143,7 @@ async def analyze_page_sentiment(page_id: str):
     using a pre-trained Hugging Face model.
     """
     # Use the existing getter function to retrieve the page
-    page = db_operations.get_page_by_id(page_id)
+    page = await db_operations.get_page_by_id(page_id)
     if page is None:
         raise HTTPException(status_code=404, detail="Page not found")
 
@@ -88,11 +152,11 @@ async def analyze_page_sentiment(page_id: str):
     if not text_to_analyze:
         return {"page_id": page_id, "sentiment": "Neutral", "score": 0.5, "message": "Page content is empty, sentiment is neutral."}
 
-    # Perform sentiment analysis using the Hugging Face pipeline
-    result = sentiment_analyzer(text_to_analyze)
+    # Perform sentiment analysis through the shared batching queue (cached per page)
+    result = await sentiment.score_page(page.id, text_to_analyze)
 
     # Extract the sentiment label and score
-    sentiment_label = result[0]['label']
-    sentiment_score = result[0]['score']
+    sentiment_label = result['label']
+    sentiment_score = result['score']
 
     return {"page_id": page_id, "text_analyzed": text_to_analyze, "sentiment": sentiment_label, "score": sentiment_score}
\ No newline at end of file
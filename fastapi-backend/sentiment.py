@@ -0,0 +1,416 @@
+# sentiment.py
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+MODEL_NAME = "distilbert-base-uncased-finetuned-sst-2-english"
+# Where the int8 ONNX export is cached so it is only built once
+QUANTIZED_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx-model")
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+# Longest chunk fed to the model: its 512-token limit minus [CLS] and [SEP]
+MAX_CHUNK_TOKENS = 510
+# Number of distinct free-form texts whose results are kept
+TEXT_CACHE_SIZE = 4096
+# Base URL of a shared model server (see model_server.py). When set, this
+# process sends texts there instead of loading its own copy of the model.
+MODEL_SERVER_URL = os.environ.get("MODEL_SERVER_URL")
+
+
+def compile_model(analyzer):
+    """
+    Graph-captures the pipeline's PyTorch model with torch.compile so each forward
+    pass runs fused kernels. Left as-is on torch<2.0 or if compilation fails.
+    """
+    import torch
+
+    try:
+        analyzer.model = torch.compile(analyzer.model, mode="reduce-overhead", fullgraph=False)
+    except Exception as exc: # AttributeError on torch<2.0
+        print(f"torch.compile unavailable, running the model eagerly: {exc}")
+        return analyzer
+    try:
+        # Compilation is lazy: backend/inductor errors only surface on the first forward pass
+        analyzer(["Compiling the sentiment model."], truncation=True)
+    except Exception as exc:
+        print(f"torch.compile failed, running the model eagerly: {exc}")
+        analyzer.model = analyzer.model._orig_mod
+    return analyzer
+
+
+async def warm_up():
+    """
+    Runs one dummy inference so model setup (and any compilation) is paid before the
+    first request. It goes through the batcher so the pipeline is only ever called
+    from the batcher's thread, never concurrently with a real batch.
+    """
+    await batcher.predict("Warming up the sentiment model.")
+
+
+def _quantized_model_ready() -> bool:
+    """True once QUANTIZED_MODEL_DIR holds a complete export (model and config)."""
+    return all(
+        os.path.exists(os.path.join(QUANTIZED_MODEL_DIR, name))
+        for name in (QUANTIZED_MODEL_FILE, "config.json")
+    )
+
+
+def load_analyzer():
+    """
+    Builds the sentiment pipeline. On a GPU the PyTorch model runs in half precision;
+    on CPU it runs on an int8-quantized ONNX Runtime export of the model. The first CPU
+    run exports and quantizes into QUANTIZED_MODEL_DIR; later runs load it directly.
+    """
+    # Heavy ML imports happen here, on first use, rather than at app import
+    import torch
+    # Import pipeline from transformers for NLP tasks
+    from transformers import AutoTokenizer, pipeline
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if torch.cuda.is_available():
+        # bf16 where the GPU supports it (Ampere and newer), otherwise fp16
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        return compile_model(pipeline("sentiment-analysis", model=MODEL_NAME, device=0, torch_dtype=dtype))
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    if not _quantized_model_ready():
+        # Build in a scratch directory and move it into place only once complete,
+        # so a killed or concurrent export never leaves a half-written model behind
+        build_dir = tempfile.mkdtemp(prefix="onnx-model-", dir=os.path.dirname(QUANTIZED_MODEL_DIR))
+        try:
+            ort_model = ORTModelForSequenceClassification.from_pretrained(
+                MODEL_NAME, export=True, provider="CPUExecutionProvider"
+            )
+            # Dynamic quantization: int8 weights, activations quantized on the fly
+            quantizer = ORTQuantizer.from_pretrained(ort_model)
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=build_dir, quantization_config=qconfig)
+            ort_model.config.save_pretrained(build_dir)
+            if os.path.isdir(QUANTIZED_MODEL_DIR) and not _quantized_model_ready():
+                shutil.rmtree(QUANTIZED_MODEL_DIR, ignore_errors=True) # Leftover from an interrupted export
+            try:
+                os.replace(build_dir, QUANTIZED_MODEL_DIR)
+            except OSError:
+                if not _quantized_model_ready(): # Another worker finishing first is fine
+                    raise
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+    model = ORTModelForSequenceClassification.from_pretrained(
+        QUANTIZED_MODEL_DIR, file_name=QUANTIZED_MODEL_FILE, provider="CPUExecutionProvider"
+    )
+    return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer)
+
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def get_analyzer():
+    """
+    Returns the shared sentiment pipeline, loading it on first use. Only the batcher
+    calls it; the lock still guards against a second loader thread loading it twice.
+    """
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                _analyzer = load_analyzer()
+    return _analyzer
+
+
+class BatchedInference:
+    """
+    Coalesces concurrent sentiment requests into a single pipeline call.
+
+    Callers await `predict(text)`; a background task drains the queue, waiting at
+    most `max_wait_ms` for up to `max_batch_size` texts, then runs one batched
+    forward pass in a worker thread and resolves each caller's future. The
+    pipeline comes from `get_analyzer`, called in that thread so a lazy first
+    load doesn't block the event loop.
+    """
+
+    def __init__(self, get_analyzer: Callable, max_batch_size: int = 32, max_wait_ms: float = 10):
+        self.get_analyzer = get_analyzer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Starts the background batching task on the running event loop."""
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancels the background batching task."""
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def predict(self, text: str) -> dict:
+        """Queues a text and waits for its result, e.g. {'label': 'POSITIVE', 'score': 0.999}."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """Waits for one item, then gathers more until the batch is full or the window closes."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _infer(self, texts: List[str]) -> List[dict]:
+        return self.get_analyzer()(texts, batch_size=self.max_batch_size, truncation=True)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                # Truncate so one over-long text can't fail the whole batch
+                results = await asyncio.to_thread(self._infer, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done(): # The caller may have gone away
+                    future.set_result(result)
+
+
+# Shared batcher for in-process inference, started by start()
+batcher = BatchedInference(get_analyzer)
+
+
+class ModelServerClient:
+    """Sends texts to the shared model server over HTTP, reusing one connection pool."""
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def start(self):
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def classify(self, texts: List[str]) -> List[dict]:
+        """Returns one {'label', 'score'} result per text, in order."""
+        response = await self.client.post("/classify", json={"inputs": texts})
+        response.raise_for_status()
+        return response.json()
+
+    async def classify_one(self, text: str) -> dict:
+        """Returns the result for a single text, which may be as long as a whole page."""
+        response = await self.client.post("/classify", json={"inputs": text})
+        response.raise_for_status()
+        return response.json()[0]
+
+
+model_server = ModelServerClient(MODEL_SERVER_URL) if MODEL_SERVER_URL else None
+_warm_up_task: Optional[asyncio.Task] = None
+
+
+def start():
+    """
+    Starts sentiment inference for this process: the model-server client when
+    MODEL_SERVER_URL is set, otherwise the local batcher plus a background
+    warm-up so the page routes are up immediately.
+    """
+    if model_server is not None:
+        model_server.start()
+        return
+    start_local()
+
+
+def start_local():
+    """Starts the local batcher and warms the model up in the background."""
+    global _warm_up_task
+    batcher.start()
+    _warm_up_task = asyncio.create_task(warm_up())
+    _warm_up_task.add_done_callback(_report_warm_up)
+
+
+async def stop_local():
+    """Stops what start_local() started."""
+    if _warm_up_task is not None:
+        _warm_up_task.cancel() # Its queued prediction would never be answered
+    await batcher.stop()
+
+
+def _report_warm_up(task: asyncio.Task):
+    """Logs a failed warm-up; the model is then loaded again on the first request."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Sentiment model warm-up failed: {task.exception()!r}")
+
+
+async def stop():
+    """Stops whatever start() started."""
+    if model_server is not None:
+        await model_server.stop()
+    else:
+        await stop_local()
+
+
+# --- Long-text chunking ---
+
+# Tokenizer used only for chunking. It is a separate instance from the
+# pipeline's so the batcher thread (which tokenizes with truncation) and the
+# chunking threads never reconfigure the same Rust tokenizer; the lock keeps
+# chunking calls from using it concurrently.
+_chunk_tokenizer = None
+_chunk_tokenizer_lock = threading.Lock()
+
+
+def _tokenize_for_chunks(text: str) -> List[Tuple[int, int]]:
+    """Returns the character offsets of every token in text (no special tokens)."""
+    global _chunk_tokenizer
+    with _chunk_tokenizer_lock:
+        if _chunk_tokenizer is None:
+            from transformers import AutoTokenizer
+            _chunk_tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        encoding = _chunk_tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return encoding["offset_mapping"]
+
+
+def split_into_chunks(text: str) -> List[Tuple[str, int]]:
+    """
+    Splits text into (chunk, token count) pieces of at most MAX_CHUNK_TOKENS tokens.
+    Chunks are sliced from the original string using the tokenizer's character
+    offsets, so no content is dropped by the model's truncation.
+    """
+    offsets = _tokenize_for_chunks(text)
+    if len(offsets) <= MAX_CHUNK_TOKENS:
+        return [(text, max(len(offsets), 1))]
+    chunks = []
+    for start in range(0, len(offsets), MAX_CHUNK_TOKENS):
+        window = offsets[start:start + MAX_CHUNK_TOKENS]
+        chunks.append((text[window[0][0]:window[-1][1]], len(window)))
+    return chunks
+
+
+def positive_probability(result: dict) -> float:
+    """Converts a {'label', 'score'} result into the probability of POSITIVE."""
+    return result["score"] if result["label"] == "POSITIVE" else 1 - result["score"]
+
+
+async def analyze(text: str) -> dict:
+    """Returns the sentiment of a text of any length, from the model server if one is configured."""
+    if model_server is not None:
+        return await model_server.classify_one(text)
+    return await analyze_local(text)
+
+
+async def analyze_many(texts: List[str]) -> List[dict]:
+    """
+    Returns one result per text, in order. The model server gets every text in
+    a single request; locally all texts join the batching queue together.
+    """
+    if model_server is not None:
+        return await model_server.classify(texts)
+    return list(await asyncio.gather(*(analyze_local(text) for text in texts)))
+
+
+async def analyze_local(text: str) -> dict:
+    """
+    Returns the sentiment of a text of any length using this process's model. Long texts are split into
+    model-sized chunks that go through the batcher together (one forward pass),
+    and the result is the token-weighted mean probability across chunks.
+    """
+    # Every token covers at least one character, so a text this short fits in
+    # one chunk; skip the extra tokenization and thread hop for it
+    if len(text) <= MAX_CHUNK_TOKENS:
+        return await batcher.predict(text)
+    chunks = await asyncio.to_thread(split_into_chunks, text)
+    if len(chunks) == 1:
+        return await batcher.predict(chunks[0][0])
+    results = await asyncio.gather(*(batcher.predict(chunk) for chunk, _ in chunks))
+    total_tokens = sum(count for _, count in chunks)
+    positive = sum(
+        positive_probability(result) * count for result, (_, count) in zip(results, chunks)
+    ) / total_tokens
+    if positive >= 0.5:
+        return {"label": "POSITIVE", "score": positive}
+    return {"label": "NEGATIVE", "score": 1 - positive}
+
+
+# --- Result caches ---
+
+# Free-form text -> result, least recently used entries evicted first
+_text_cache: "OrderedDict[str, dict]" = OrderedDict()
+# Page ID -> (content hash, result); entries are dropped when a page changes
+_page_cache: Dict[str, Tuple[str, dict]] = {}
+
+
+def _cached_text(text: str) -> Optional[dict]:
+    result = _text_cache.get(text)
+    if result is not None:
+        _text_cache.move_to_end(text)
+    return result
+
+
+def _cache_text(text: str, result: dict):
+    _text_cache[text] = result
+    if len(_text_cache) > TEXT_CACHE_SIZE:
+        _text_cache.popitem(last=False)
+
+
+async def score(text: str) -> dict:
+    """Returns the sentiment of a text, reusing the result for repeated queries."""
+    result = _cached_text(text)
+    if result is None:
+        result = await analyze(text)
+        _cache_text(text, result)
+    return result
+
+
+async def score_many(texts: List[str]) -> List[dict]:
+    """Returns one result per text, in order; only uncached, distinct texts are analyzed."""
+    results = {text: _cached_text(text) for text in texts}
+    missing = [text for text, result in results.items() if result is None]
+    if missing:
+        for text, result in zip(missing, await analyze_many(missing)):
+            results[text] = result
+            _cache_text(text, result)
+    return [results[text] for text in texts]
+
+
+async def score_page(page_id: str, content: str) -> dict:
+    """Returns the sentiment of a page's content, reusing it until the content changes."""
+    content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    cached = _page_cache.get(page_id)
+    if cached is not None and cached[0] == content_hash:
+        return cached[1]
+    result = await analyze(content)
+    _page_cache[page_id] = (content_hash, result)
+    return result
+
+
+def forget_page(page_id: str):
+    """Drops the cached result for a page that was updated or deleted."""
+    _page_cache.pop(page_id, None)
@@ -47,12 +47,21 @@ function App() {
     setLoading(true);
     setError(null);
     try {
-      const response = await retryFetch(`${API_BASE_URL}/pages/`); // Use retryFetch here
-      if (!response.ok) {
-        const errorData = await response.json();
-        throw new Error(`HTTP error! Status: ${response.status} - ${errorData.detail || response.statusText}`);
-      }
-      const data = await response.json();
+      // The backend returns pages in batches; follow X-Next-Cursor until the last batch.
+      const data = [];
+      let cursor = null;
+      do {
+        const url = cursor
+          ? `${API_BASE_URL}/pages/?cursor=${encodeURIComponent(cursor)}`
+          : `${API_BASE_URL}/pages/`;
+        const response = await retryFetch(url); // Use retryFetch here
+        if (!response.ok) {
+          const errorData = await response.json();
+          throw new Error(`HTTP error! Status: ${response.status} - ${errorData.detail || response.statusText}`);
+        }
+        data.push(...(await response.json()));
+        cursor = response.headers.get("X-Next-Cursor");
+      } while (cursor);
       console.log("Received pages data for list:", data);
       setPages(data);
     } catch (err) {